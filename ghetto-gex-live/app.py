@@ -16,6 +16,7 @@ from quart import (
 )
 import aiohttp
 import asyncio
+import uvloop
 
 from data_utils import (
     get_session,is_test_func,
@@ -178,7 +179,8 @@ async def gex_plot():
         optionchain = get_data(ticker,'optionchain',tstamp_filter)
 
         strike_list = sorted(list(set([x['strike'] for x in optionchain])),reverse=True)
-        strike_list = [int(x) for x in strike_list]
+        # strikes can be fractional (582.5), int() would fold them into the 582 label
+        strike_list = [float(x) for x in strike_list]
         put_gexTradeDayVolume = [x['gextradeDayVolume'] for x in optionchain if x['contract_type']=="P"]
         put_gexSummaryOpenInterest = [x['gexSummaryOpenInterest'] for x in optionchain if x['contract_type']=="P"]
         call_gexTradeDayVolume = [x['gextradeDayVolume'] for x in optionchain if x['contract_type']=="C"]
@@ -265,5 +267,7 @@ if __name__ == '__main__':
     parser.add_argument("port",type=int)
     parser.add_argument('-d', '--debug',action='store_true')
     args = parser.parse_args()
+    # background_subscribe runs as a quart background task, so the streamer shares this loop
+    uvloop.install()
     app.run(debug=args.debug,host="0.0.0.0",port=args.port)
 
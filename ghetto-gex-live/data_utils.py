@@ -7,6 +7,7 @@ import re
 import sys
 import uuid
 import ast
+import glob
 import time
 import math
 import traceback
@@ -16,10 +17,9 @@ import pathlib
 
 import pandas as pd
 import numpy as np
+import orjson
 
 import uuid
-import aiofiles
-import aiofiles.os
 import asyncio
 from dataclasses import dataclass
 from tastytrade import DXLinkStreamer
@@ -68,16 +68,34 @@ def get_session(remember_me=True):
 # commit https://github.com/tastyware/tastytrade/blob/97e1bc6632cfd4a15721da816085eb906a02bcb0/docs/data-streamer.rst#L76
 #
 
-async def save_data_to_json(ticker,streamer_symbols,event_type,event):
-    tstamp = now_in_new_york().strftime("%Y-%m-%d-%H-%M-%S.%f")
-    daystamp = now_in_new_york().strftime("%Y-%m-%d")
-    workdir = os.path.join(shared_dir,ticker,daystamp,streamer_symbols,event_type)
-    await aiofiles.os.makedirs(workdir,exist_ok=True)
-    uid = uuid.uuid4().hex
-    json_file = os.path.join(workdir,f'{tstamp}-uid-{uid}.json')
-    async with aiofiles.open(json_file,'w') as f:
-        event_dict = dict(event)
-        await f.write(json.dumps(event_dict,indent=4,sort_keys=True,default=str))
+# blocking, writes a batch of (event_type,streamer_symbols,event), call it via asyncio.to_thread
+# so the whole batch costs one thread hop instead of several aiofiles hops per event.
+def save_data_to_json(ticker,updates):
+    workdir_set = set()
+    for event_type,streamer_symbols,event in updates:
+        tstamp = now_in_new_york().strftime("%Y-%m-%d-%H-%M-%S.%f")
+        daystamp = now_in_new_york().strftime("%Y-%m-%d")
+        workdir = os.path.join(shared_dir,ticker,daystamp,streamer_symbols,event_type)
+        if workdir not in workdir_set:
+            os.makedirs(workdir,exist_ok=True)
+            workdir_set.add(workdir)
+        uid = uuid.uuid4().hex
+        json_file = os.path.join(workdir,f'{tstamp}-uid-{uid}.json')
+        with open(json_file,'wb') as f:
+            event_dict = dict(event)
+            f.write(orjson.dumps(event_dict,default=str,option=orjson.OPT_INDENT_2|orjson.OPT_SORT_KEYS))
+
+def get_equity_and_chain(session,ticker):
+    underlying = Equity.get_equity(session, ticker)
+    chain = get_option_chain(session, ticker)
+    return underlying, chain
+
+def log_task_exception(task):
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        logger.error(f"updater died {task.get_name()}",exc_info=exc)
 
 
 #
@@ -108,23 +126,32 @@ class LivePrices:
         expiration: datetime.date = today_in_new_york()
         ):
 
-        underlying = Equity.get_equity(session, ticker)
-        chain = get_option_chain(session, ticker)
+        # both are blocking http calls on the same session, which is not documented
+        # as thread-safe, so they share one worker thread, off the event loop
+        underlying, chain = await asyncio.to_thread(get_equity_and_chain, session, ticker)
         expiration = sorted(list(chain.keys()))[0]
         options = [o for o in chain[expiration]]
         # the `streamer_symbol` property is the symbol used by the streamer
         streamer_symbols = [o.streamer_symbol for o in options]
 
         streamer = await DXLinkStreamer.create(session)
-        # subscribe to quotes and greeks for all options on that date
-        await streamer.subscribe(EventType.QUOTE, [ticker] + streamer_symbols)
-        await streamer.subscribe(EventType.SUMMARY, streamer_symbols)
-        await streamer.subscribe(EventType.TRADE, streamer_symbols)
-        await streamer.subscribe(EventType.GREEKS, streamer_symbols)
-        
+
         start_time = now_in_new_york()
         start_time = datetime.datetime(start_time.year,start_time.month,start_time.day,9,30,0)
-        await streamer.subscribe_candle([ticker] + streamer_symbols, CANDLE_TYPE, start_time)
+        # subscribe to quotes and greeks for all options on that date,
+        # return_exceptions so every subscribe has finished before we raise on a failure
+        results = await asyncio.gather(
+            streamer.subscribe(EventType.QUOTE, [ticker] + streamer_symbols),
+            streamer.subscribe(EventType.SUMMARY, streamer_symbols),
+            streamer.subscribe(EventType.TRADE, streamer_symbols),
+            streamer.subscribe(EventType.GREEKS, streamer_symbols),
+            streamer.subscribe_candle([ticker] + streamer_symbols, CANDLE_TYPE, start_time),
+            return_exceptions=True,
+        )
+        exc_list = [x for x in results if isinstance(x,BaseException)]
+        if len(exc_list) > 0:
+            await streamer.close()
+            raise exc_list[0]
 
         puts = [o for o in options if o.option_type == OptionType.PUT]
         calls = [o for o in options if o.option_type == OptionType.CALL]
@@ -132,17 +159,37 @@ class LivePrices:
         self = cls({}, {}, {}, {}, {}, streamer, 
             underlying, puts, calls, streamer_symbols,ticker)
 
-        t_listen_quotes = asyncio.create_task(self._update_quotes())
-        t_listen_summaries = asyncio.create_task(self._update_summaries())
-        t_listen_trades = asyncio.create_task(self._update_trades())
-        t_listen_greeks = asyncio.create_task(self._update_greeks())
-        t_listen_candles = asyncio.create_task(self._update_candles())
-        
-        asyncio.gather(t_listen_quotes, t_listen_candles, t_listen_summaries, t_listen_trades, t_listen_greeks)
-
-        # wait we have quotes and greeks for each option
-        while len(self.quotes) < 1 or len(self.candles) < 1 or len(self.greeks) < 1 or len(self.summaries) < 1 or len(self.trades) < 1:
-            await asyncio.sleep(0.1)
+        # set by `_update` once every event dict holds `_ready_threshold` symbols
+        self._ready = asyncio.Event()
+        self._ready_threshold = 1
+
+        # one `_update` consumer per event type, each writing into its own dict
+        self._tasks = [asyncio.create_task(self._update(event_type,events)) for event_type,events in (
+            (EventType.QUOTE, self.quotes),
+            (EventType.CANDLE, self.candles),
+            (EventType.SUMMARY, self.summaries),
+            (EventType.TRADE, self.trades),
+            (EventType.GREEKS, self.greeks),
+        )]
+
+        # keep references so updaters are not garbage collected and failures get logged
+        for t in self._tasks:
+            t.add_done_callback(log_task_exception)
+
+        # wait we have quotes and greeks for each option,
+        # but give up if an updater dies before that, otherwise create never returns
+        ready_waiter = asyncio.create_task(self._ready.wait())
+        await asyncio.wait({ready_waiter, *self._tasks},return_when=asyncio.FIRST_COMPLETED)
+        # check the updaters even if ready is set, one may have died in the same step
+        dead = [t for t in self._tasks if t.done()]
+        if len(dead) > 0:
+            ready_waiter.cancel()
+            for t in self._tasks:
+                t.cancel()
+            await self.streamer.close()
+            t = dead[0]
+            exc = None if t.cancelled() else t.exception()
+            raise exc or RuntimeError("updater stopped before data arrived")
 
         return self
 
@@ -151,35 +198,43 @@ class LivePrices:
         await self.streamer.unsubscribe(EventType.QUOTE, self.streamer_symbols)
         await self.streamer.unsubscribe(EventType.SUMMARY, self.streamer_symbols)
         await self.streamer.unsubscribe(EventType.TRADE, self.streamer_symbols)
-        await self.streamer.unsubscribe_candle([ticker] + +self.streamer_symbols,CANDLE_TYPE)
+        # unsubscribe_candle takes a single symbol
+        for symbol in [self.ticker] + self.streamer_symbols:
+            await self.streamer.unsubscribe_candle(symbol,CANDLE_TYPE)
         await self.streamer.close()
+        for t in self._tasks:
+            t.cancel()
         logger.debug(f"sreamer closed...{self.streamer_symbols}")
 
-    async def _update_quotes(self):
-        async for e in self.streamer.listen(EventType.QUOTE):
-            self.quotes[e.eventSymbol] = e
-            await save_data_to_json(self.ticker,e.eventSymbol,EventType.QUOTE,e)
-
-    async def _update_candles(self):
-        async for e in self.streamer.listen(EventType.CANDLE):
-            streamer_symbols = e.eventSymbol.replace("{="+CANDLE_TYPE+",tho=true}","")
-            self.candles[streamer_symbols] = e
-            await save_data_to_json(self.ticker,streamer_symbols,EventType.CANDLE,e)
-
-    async def _update_summaries(self):
-        async for e in self.streamer.listen(EventType.SUMMARY):
-            self.summaries[e.eventSymbol] = e
-            await save_data_to_json(self.ticker,e.eventSymbol,EventType.SUMMARY,e)
-
-    async def _update_trades(self):
-        async for e in self.streamer.listen(EventType.TRADE):
-            self.trades[e.eventSymbol] = e
-            await save_data_to_json(self.ticker,e.eventSymbol,EventType.TRADE,e)
-
-    async def _update_greeks(self):
-        async for e in self.streamer.listen(EventType.GREEKS):
-            self.greeks[e.eventSymbol] = e
-            await save_data_to_json(self.ticker,e.eventSymbol,EventType.GREEKS,e)
+    def _maybe_signal(self):
+        # the dicts are keyed by symbol, so their length is the per-type symbol count
+        counts = (len(self.quotes),len(self.candles),len(self.summaries),len(self.trades),len(self.greeks))
+        if all(x >= self._ready_threshold for x in counts):
+            self._ready.set()
+
+    async def _listen(self, event_type):
+        # on each wakeup also take everything already queued for this type,
+        # so `_update` can persist the batch in a single save_data_to_json call
+        async for e in self.streamer.listen(event_type):
+            batch = [e]
+            while (e := self.streamer.get_event_nowait(event_type)) is not None:
+                batch.append(e)
+            yield batch
+
+    async def _update(self, event_type, events):
+        async for batch in self._listen(event_type):
+            updates = []
+            for e in batch:
+                symbol = e.eventSymbol
+                if event_type == EventType.CANDLE:
+                    symbol = symbol.replace("{="+CANDLE_TYPE+",tho=true}","")
+                updates.append((event_type,symbol,e))
+            await asyncio.to_thread(save_data_to_json,self.ticker,updates)
+            # publish only once the batch is on disk, so a consumer whose
+            # saves fail never counts towards `_ready`
+            events.update((symbol,e) for _,symbol,e in updates)
+            if not self._ready.is_set():
+                self._maybe_signal()
 
 def get_cancel_file(ticker):
     return f"/tmp/cancel-{ticker}.txt"
@@ -200,10 +255,17 @@ async def background_subscribe(ticker,session):
         while True:
 
             # Print or process the quotes in real time
-            logger.info(f"Current quotes: {live_prices.quotes}")
-            logger.info(f"Current candles: {live_prices.candles}")
-            logger.info(f"Current summaries: {live_prices.summaries}")
-            logger.info(f"Current trades {live_prices.trades}")
+            # these dicts hold an event per contract, only format them when debugging
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Current quotes: %s",live_prices.quotes)
+                logger.debug("Current candles: %s",live_prices.candles)
+                logger.debug("Current summaries: %s",live_prices.summaries)
+                logger.debug("Current trades %s",live_prices.trades)
+            # stop instead of reporting a live subscription once an updater has died
+            if any(t.done() for t in live_prices._tasks):
+                logger.error(f"updater stopped, ending subscription...")
+                await live_prices.shutdown()
+                raise RuntimeError("updater stopped")
             pathlib.Path(running_file).touch()
             await asyncio.sleep(5)
             if os.path.exists(cancel_file):
@@ -252,6 +314,10 @@ def get_underlying_df(ticker,tstamp,resample=None,tstamp_filter=None):
             underlying_list.append(content)
 
     df = pd.DataFrame(underlying_list)
+    # prices are saved as strings, make them float64 once here
+    cols = [x for x in ('open','high','low','close') if x in df.columns]
+    if len(cols)>0:
+        df[cols] = df[cols].astype(float)
     if len(df)>0:
         df = df[df.time.notnull()]
 
@@ -302,16 +368,15 @@ def tick_direction(ticker,tstamp_filter):
     mydict = {"PUTS":pjson,"CALLS":cjson}
     return mydict
 
-# sample eventSymbol ".TSLA240927C105"
-PATTERN = r"\.([A-Z]+)(\d{6})([CP])(\d+)"
+# sample eventSymbol ".TSLA240927C105", ".SPY241018C582.5"
+PATTERN = r"\.([A-Z]+)(\d{6})([CP])(\d+(?:\.\d+)?)"
+_SYMBOL_RE = re.compile(PATTERN)
 
-def parse_symbol(eventSymbol):
-    matched = re.match(PATTERN,eventSymbol)
-    ticker = matched.group(1)
-    expiration = datetime.datetime.strptime(matched.group(2),'%y%m%d').date()
-    contract_type = matched.group(3)
-    strike = float(matched.group(4))
-    return ticker,expiration,contract_type,strike
+def load_json_file(json_file):
+    if json_file is None:
+        return {}
+    with open(json_file,'r') as f:
+        return json.loads(f.read())
 
 #
 # is there a popular library with gex computation?
@@ -323,7 +388,6 @@ def get_gex_df(ticker,tstamp,tstamp_filter):
     underlying_df = get_underlying_df(ticker,tstamp)
     try:
         spot_price = float(underlying_df.iloc[-1].close)
-        spot_price = np.array(spot_price).astype(float)
     except:
         spot_price = np.nan
         logger.error(traceback.format_exc())
@@ -333,84 +397,45 @@ def get_gex_df(ticker,tstamp,tstamp_filter):
     folder_path = os.path.join(shared_dir,ticker,daystamp)
     contract_folder_list =  sorted([os.path.join(folder_path,x) for x in os.listdir(folder_path) if f".{ticker}" in x])
     
-    mylist = []
-    for contract_folder in contract_folder_list:
+    n = len(contract_folder_list)
+    symbol_arr = np.array([os.path.basename(x) for x in contract_folder_list],dtype=object)
+
+    # parse all symbols in one pass, str.extract + pd.to_datetime instead of a per-contract regex/strptime
+    parsed = pd.Series(symbol_arr,dtype=object).str.extract(_SYMBOL_RE)
+    ticker_arr = parsed[0].to_numpy(dtype=object)
+    expiration_arr = pd.to_datetime(parsed[1],format='%y%m%d').dt.date.to_numpy(dtype=object)
+    contract_type_arr = parsed[2].to_numpy(dtype=object)
+    strike_arr = parsed[3].astype(np.float64).to_numpy()
+    contract_type_int_arr = np.where(contract_type_arr=='C',1,-1).astype(np.int64)
+
+    tickDirection_arr = np.empty(n,dtype=object)
+    gamma_arr = np.empty(n,dtype=np.float64)
+    tradeDayVolume_arr = np.empty(n,dtype=np.float64)
+    summaryOpenInterest_arr = np.empty(n,dtype=np.float64)
+    candleVolume_arr = np.empty(n,dtype=np.float64)
+
+    # single glob over all contract/event folders instead of 4 rglob per contract,
+    # keeping the latest file per (contract,event), file names start with the tstamp.
+    latest_file = {}
+    json_file_list = glob.glob(os.path.join(folder_path,f".{ticker}*","*",f"{tstamp_filter}*.json"))
+    for json_file in sorted(json_file_list):
+        contract_folder,event_folder = json_file.split(os.sep)[-3:-1]
+        latest_file[(contract_folder,event_folder)] = json_file
+
+    for i,streamer_symbol in enumerate(symbol_arr):
         # Candle  Greeks  Quote  Summary  Trade
-        greeks_folder = os.path.join(contract_folder,"Greeks")
-        candle_folder = os.path.join(contract_folder,"Candle")
-        summary_folder = os.path.join(contract_folder,"Summary")
-        trade_folder = os.path.join(contract_folder,"Trade")
-        greeks_file_list = sorted([str(x) for x in pathlib.Path(greeks_folder).rglob(f"{tstamp_filter}*.json")])
-        candle_file_list = sorted([str(x) for x in pathlib.Path(candle_folder).rglob(f"{tstamp_filter}*.json")])
-        summary_file_list = sorted([str(x) for x in pathlib.Path(summary_folder).rglob(f"{tstamp_filter}*.json")])
-        trade_file_list = sorted([str(x) for x in pathlib.Path(trade_folder).rglob(f"{tstamp_filter}*.json")])
-        streamer_symbol = os.path.basename(contract_folder)
-
-
-        ticker,expiration,contractType,strike = parse_symbol(streamer_symbol)
-        greeks_dict = {}
-        candle_dict = {}
-        summary_dict = {}
-        trade_dict = {}
-        if len(greeks_file_list)>0:
-            greeks_file = greeks_file_list[-1]
-            with open(greeks_file,'r') as f:
-                greeks_dict = json.loads(f.read())
-
-        if len(candle_file_list)>0:
-            candle_file = candle_file_list[-1]
-            with open(candle_file,'r') as f:
-                candle_dict = json.loads(f.read())
-
-        if len(summary_file_list)>0:
-            summary_file = summary_file_list[-1]
-            with open(summary_file,'r') as f:
-                summary_dict = json.loads(f.read())
-
-        if len(trade_file_list)>0:
-            trade_file = trade_file_list[-1]
-            with open(trade_file,'r') as f:
-                trade_dict = json.loads(f.read())
+        greeks_dict = load_json_file(latest_file.get((streamer_symbol,"Greeks")))
+        candle_dict = load_json_file(latest_file.get((streamer_symbol,"Candle")))
+        summary_dict = load_json_file(latest_file.get((streamer_symbol,"Summary")))
+        trade_dict = load_json_file(latest_file.get((streamer_symbol,"Trade")))
 
         # maye not a good idea to put 0
-        if len(greeks_dict)>0:
-            gamma = greeks_dict['gamma']
-        else:
-            gamma = 0
-
-        if len(candle_dict)>0:
-            candleVolume = candle_dict['volume']
-        else:
-            candleVolume = 0
-
-        if len(candle_dict)>0:
-            tradeDayVolume = trade_dict['dayVolume']
-            tickDirection = trade_dict['tickDirection']
-        else:
-            tradeDayVolume = 0
-            tickDirection = None
-
-        if len(summary_dict)>0:
-            summaryOpenInterest = summary_dict['openInterest']
-        else:
-            summaryOpenInterest = 0
-            
-        row = dict(
-            symbol=streamer_symbol,
-            ticker=ticker,
-            expiration=expiration,
-            contract_type=contractType,
-            strike=strike,
-            gamma=gamma,
-            tradeDayVolume=tradeDayVolume,
-            tickDirection=tickDirection,
-            summaryOpenInterest=summaryOpenInterest,
-            candleVolume=candleVolume,
-        )
-        mylist.append(row)
+        gamma_arr[i] = greeks_dict.get('gamma',0)
+        candleVolume_arr[i] = candle_dict.get('volume',0)
+        tradeDayVolume_arr[i] = trade_dict.get('dayVolume',0)
+        tickDirection_arr[i] = trade_dict.get('tickDirection')
+        summaryOpenInterest_arr[i] = summary_dict.get('openInterest',0)
 
-    df = pd.DataFrame(mylist)
-    df['contract_type_int'] = df.contract_type.apply(lambda x: 1 if x=='C' else -1)
     #
     # TODO:
     # + [ ] unit is not right check below perfiliev blog
@@ -419,11 +444,25 @@ def get_gex_df(ticker,tstamp,tstamp_filter):
     #
     # + [ ] add unit,label to charts
     # 
-
-    df['spot_price'] = spot_price
-    df['gexSummaryOpenInterest'] = df['gamma'].astype(float) * df['summaryOpenInterest'].astype(float) * 100 * spot_price * spot_price * 0.01 * df['contract_type_int']
-    df['gexCandleVolume'] = df['gamma'].astype(float) * df['candleVolume'].astype(float) * 100 * spot_price * spot_price * 0.01 * df['contract_type_int']
-    df['gextradeDayVolume'] = df['gamma'].astype(float) * df['tradeDayVolume'].astype(float) * 100 * spot_price * spot_price * 0.01 * df['contract_type_int']
+    # 100 shares per contract * 1% move, i.e. 100*0.01 == 1, so it is folded out of k.
+    k = gamma_arr * contract_type_int_arr * (spot_price * spot_price)
+    df = pd.DataFrame({
+        'symbol': symbol_arr,
+        'ticker': ticker_arr,
+        'expiration': expiration_arr,
+        'contract_type': contract_type_arr,
+        'strike': strike_arr,
+        'gamma': gamma_arr,
+        'tradeDayVolume': tradeDayVolume_arr,
+        'tickDirection': tickDirection_arr,
+        'summaryOpenInterest': summaryOpenInterest_arr,
+        'candleVolume': candleVolume_arr,
+        'contract_type_int': contract_type_int_arr,
+        'spot_price': np.full(n,spot_price,dtype=np.float64),
+        'gexSummaryOpenInterest': k * summaryOpenInterest_arr,
+        'gexCandleVolume': k * candleVolume_arr,
+        'gextradeDayVolume': k * tradeDayVolume_arr,
+    })
     return df
 
 #
@@ -449,6 +488,8 @@ if __name__ == "__main__":
     
     if action == "background_subscribe":
         session = get_session()
+        import uvloop
+        uvloop.install()
         output = asyncio.run(background_subscribe(ticker,session))
     
     